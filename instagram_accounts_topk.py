@@ -4,33 +4,269 @@ Uses non-deprecated APIs only: fbsearch_accounts_v3, user_by_id_v2, user_clips.
 """
 import argparse
 import asyncio
+import atexit
 import csv
-import json
+import heapq
+import multiprocessing
 import os
+import random
+import re
+import sqlite3
 import sys
-from dataclasses import dataclass
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from collections import deque
+from contextlib import aclosing, asynccontextmanager
+from contextvars import ContextVar
 from datetime import datetime, timezone
+from operator import itemgetter
 from pathlib import Path
 from traceback import format_exception
-from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, TypeVar
+from typing import IO, Any, AsyncIterator, Awaitable, BinaryIO, Callable, Deque, Dict, Iterable, List, Optional, Tuple, TypeVar
 
+import httpx  # hikerapi's HTTP backend
+import orjson
 from dotenv import load_dotenv
 from hikerapi import AsyncClient
+from hikerapi.base import BaseClient
 
 load_dotenv()
 
 # Retry transient network errors (HikerAPI/httpx). Do not retry API logic errors (KeyError, state=False).
-try:
-    import httpx
-    _RETRY_EXCEPTIONS: Tuple[type, ...] = (asyncio.TimeoutError, httpx.ReadTimeout, httpx.ConnectError)
-except ImportError:
-    _RETRY_EXCEPTIONS = (asyncio.TimeoutError,)
+_RETRY_EXCEPTIONS: Tuple[type, ...] = (
+    asyncio.TimeoutError, httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError,
+)
 
 T = TypeVar("T")
 DEFAULT_REQUEST_TIMEOUT = 30.0
 DEFAULT_CONCURRENCY = 15
-RETRY_ATTEMPTS = 2
+DEFAULT_RATE = 10.0  # requests/sec across all HikerAPI calls
+KEEPALIVE_EXPIRY = 60.0  # seconds an idle pooled connection is kept
+CACHE_PATH = Path(".hiker_cache") / "responses.sqlite3"
+DEFAULT_CACHE_TTL = 3600.0
+RETRY_ATTEMPTS = 3
 RETRY_DELAY = 1.5
+FLUSH_EVERY = 50  # flush output files every N written accounts
+WRITE_BUFFER = 1 << 20  # 1 MiB buffer per output file
+ERROR_LOG_BUFFER = 1 << 16
+# Below this many reels, pickling to the process pool costs more than normalizing inline.
+NORMALIZE_OFFLOAD_MIN = 500
+
+# hikerapi does not raise on HTTP status; HikerClient._request retries 429/5xx by
+# status code. This only backs that up for error payloads (state: false) whose
+# message says the failure is transient. No bare status numbers: "balance 0.500".
+_TRANSIENT_RE = re.compile(
+    r"too many requests|rate.?limit|temporarily unavailable|bad gateway|timed? ?out",
+    re.IGNORECASE,
+)
+
+
+class TransientAPIError(Exception):
+    """HikerAPI returned a rate-limit / server-error payload instead of data."""
+
+
+# Errors after which a single search page / profile / reels call is logged and skipped:
+# transient ones once retries are exhausted, and garbled (non-decodable) JSON bodies.
+# Anything else propagates and is reported per task by process_accounts.
+_SKIP_EXCEPTIONS: Tuple[type, ...] = (*_RETRY_EXCEPTIONS, TransientAPIError, orjson.JSONDecodeError)
+# user_clips is the only call whose result hikerapi parses itself (extract_user_clips,
+# item["pk"]); on 404/403-style error payloads that parsing raises one of these.
+_CLIPS_SKIP_EXCEPTIONS: Tuple[type, ...] = (*_SKIP_EXCEPTIONS, KeyError, TypeError, AttributeError)
+
+
+def _transient_payload_message(res: Any) -> Optional[str]:
+    """Return the error text if res is an error payload with a transient message, else None."""
+    if not (isinstance(res, dict) and (res.get("state") is False or "detail" in res)):
+        return None
+    text = str(res.get("error") or res.get("detail") or res.get("exc_type") or "")
+    return text if _TRANSIENT_RE.search(text) else None
+
+
+class RateLimiter:
+    """Paces HikerAPI HTTP requests: at most `rate` req/sec and `connections` in flight.
+
+    A background dispatcher hands out one request slot every 1/rate seconds (no
+    pacing if rate <= 0), only once a connection slot is free. Priority waiters
+    (search pages) are served before everyone else, so search pagination is not
+    queued behind the account requests it has already spawned. Must be created
+    inside the running event loop.
+    """
+
+    def __init__(self, rate: float, connections: int) -> None:
+        self._interval = 1.0 / rate if rate > 0 else 0.0
+        self._sem = asyncio.Semaphore(max(1, connections))
+        # (priority, normal) FIFO queues of waiter futures
+        self._waiters: Tuple[Deque["asyncio.Future[None]"], ...] = (deque(), deque())
+        self._wakeup = asyncio.Event()
+        self._dispatch_task: Optional["asyncio.Task[None]"] = None
+
+    def _next_waiter(self) -> Optional["asyncio.Future[None]"]:
+        for queue in self._waiters:
+            while queue:
+                fut = queue.popleft()
+                if not fut.done():  # skip waiters cancelled while queued
+                    return fut
+        return None
+
+    async def _dispatch(self) -> None:
+        while True:
+            if not any(self._waiters):
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            await self._sem.acquire()
+            fut = self._next_waiter()
+            if fut is None:
+                self._sem.release()
+                continue
+            fut.set_result(None)
+            if self._interval:
+                await asyncio.sleep(self._interval)
+
+    @asynccontextmanager
+    async def acquire(self, priority: bool = False) -> AsyncIterator[None]:
+        if self._dispatch_task is None:
+            self._dispatch_task = asyncio.create_task(self._dispatch())
+        fut: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+        self._waiters[0 if priority else 1].append(fut)
+        self._wakeup.set()
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self._sem.release()  # slot was granted just before we were cancelled
+            raise
+        try:
+            yield
+        finally:
+            self._sem.release()
+
+    async def aclose(self) -> None:
+        if self._dispatch_task is not None:
+            self._dispatch_task.cancel()
+            try:
+                await self._dispatch_task
+            except asyncio.CancelledError:
+                pass
+            self._dispatch_task = None
+
+
+# Set in a task to make its HikerAPI requests jump the limiter queue (search pages).
+# create_task copies the context, so setting it inside a task stays task-local.
+_LIMITER_PRIORITY: ContextVar[bool] = ContextVar("limiter_priority", default=False)
+
+
+class HikerClient(AsyncClient):
+    """hikerapi.AsyncClient with a rate limiter and an httpx pool sized for `connections`.
+
+    Every HTTP request, including each page fetched inside paging helpers such as
+    user_clips, takes one RateLimiter slot, so --rate / --connections hold per request.
+    Instead of hikerapi's default-limits httpx.AsyncClient, build one that keeps
+    `connections` keep-alive sockets open so TLS handshakes are reused across all
+    search/profile/reels calls. Responses are decoded with orjson instead of httpx's
+    stdlib json. Create inside the running loop and use `async with`.
+
+    Relies on hikerapi internals (_url, _headers, _timeout, _client, _request), hence
+    the hikerapi<1.8 pin in pyproject.toml.
+    """
+
+    def __init__(self, token: str, timeout: float, connections: int, rate: float = DEFAULT_RATE) -> None:
+        # Skip BaseAsyncClient.__init__, which would build an httpx client we never use.
+        BaseClient.__init__(self, token=token, timeout=timeout)
+        self._limiter = RateLimiter(rate, connections)
+        self._client = httpx.AsyncClient(
+            base_url=self._url,
+            timeout=self._timeout,
+            headers=self._headers,
+            limits=httpx.Limits(
+                max_connections=connections,
+                max_keepalive_connections=connections,
+                keepalive_expiry=KEEPALIVE_EXPIRY,
+            ),
+        )
+
+    async def _request(
+        self,
+        method: str,
+        path: str,
+        params: Optional[Dict] = None,
+        data: Optional[Dict] = None,
+        json: Optional[Dict] = None,
+        headers: Optional[Dict] = None,
+    ) -> Any:
+        """Same as hikerapi's _request, but rate-limited and decoding JSON bodies with orjson."""
+        if params:
+            params = {k: v for k, v in params.items() if v}
+        async with self._limiter.acquire(_LIMITER_PRIORITY.get()):
+            resp = await self._client.request(
+                method,
+                path,
+                headers=self._headers | (headers or {}),
+                params=params,
+                data=data,
+                json=json,
+                timeout=self._timeout,
+            )
+        # Paging helpers (user_clips) parse each page internally, so a 429/5xx payload
+        # would surface as a KeyError there; raise it as retryable at the source instead.
+        if resp.status_code == 429 or resp.status_code >= 500:
+            body = resp.content[:200].decode("utf-8", errors="replace")
+            raise TransientAPIError(f"HTTP {resp.status_code}: {body}")
+        res = orjson.loads(resp.content) if "json" in resp.headers.get("content-type", "").lower() else resp.content
+        msg = _transient_payload_message(res)
+        if msg is not None:
+            raise TransientAPIError(msg)
+        return res
+
+    async def aclose(self) -> None:
+        await self._limiter.aclose()
+        await super().aclose()
+
+    async def __aexit__(self, *args: Any) -> None:
+        await self._limiter.aclose()
+        await super().__aexit__(*args)
+
+
+class ResponseCache:
+    """SQLite-backed TTL cache for parsed HikerAPI responses, keyed by (namespace, key).
+
+    Lets reruns with the same --query skip the (billable) user_by_id_v2 / user_clips
+    calls. Values are stored as orjson bytes; expired rows are ignored on read and
+    overwritten on the next store.
+    """
+
+    def __init__(self, path: Path, ttl: float) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._ttl = ttl
+        self._db = sqlite3.connect(str(path), isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "ns TEXT NOT NULL, key TEXT NOT NULL, ts REAL NOT NULL, value BLOB NOT NULL, "
+            "PRIMARY KEY (ns, key))"
+        )
+
+    def get(self, ns: str, key: str) -> Optional[Any]:
+        row = self._db.execute(
+            "SELECT ts, value FROM responses WHERE ns = ? AND key = ?", (ns, key)
+        ).fetchone()
+        if row is None or time.time() - row[0] > self._ttl:
+            return None
+        return orjson.loads(row[1])
+
+    def set(self, ns: str, key: str, value: Any) -> None:
+        try:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (ns, key, ts, value) VALUES (?, ?, ?, ?)",
+                (ns, key, time.time(), orjson.dumps(value)),
+            )
+        except (sqlite3.Error, TypeError) as e:
+            log_error("cache_set", ns=ns, key=key, _exc=e)
+
+    def close(self) -> None:
+        self._db.close()
 
 
 async def _with_retry(
@@ -38,21 +274,31 @@ async def _with_retry(
     max_attempts: int = RETRY_ATTEMPTS,
     delay: float = RETRY_DELAY,
 ) -> T:
-    """Run coroutine from factory; on transient errors, wait and retry up to max_attempts."""
+    """Run coroutine from factory; on transient errors, back off and retry.
+
+    Backoff is exponential with jitter: delay * 2**attempt + uniform(0, delay).
+    Rate limiting happens per HTTP request inside HikerClient, not here.
+    """
     last: Optional[Exception] = None
-    for attempt in range(max_attempts):
+    for attempt in range(max(1, max_attempts)):
         try:
-            return await coro_factory()
-        except _RETRY_EXCEPTIONS as e:
+            res = await coro_factory()
+            msg = _transient_payload_message(res)
+            if msg is not None:
+                raise TransientAPIError(msg)
+            return res
+        except (*_RETRY_EXCEPTIONS, TransientAPIError) as e:
             last = e
             if attempt < max_attempts - 1:
-                await asyncio.sleep(delay)
+                await asyncio.sleep(delay * 2 ** attempt + random.uniform(0, delay))
     if last is not None:
         raise last
     raise RuntimeError("unreachable")
 
 AccountDict = Dict[str, Any]
 MediaDict = Dict[str, Any]
+# (normalized account, its top-k reels); a plain tuple keeps the per-account container cheap.
+AccountWithReels = Tuple[AccountDict, List[MediaDict]]
 
 ACCOUNT_CSV_FIELDS = (
     "id", "username", "full_name", "surname", "biography", "external_url",
@@ -63,17 +309,51 @@ REEL_CSV_FIELDS = (
     "like_count", "comment_count", "caption_text", "permalink",
 )
 
+# Normalized dicts always carry every CSV field, so rows can be pulled with itemgetter.
+_account_row = itemgetter(*ACCOUNT_CSV_FIELDS)
+_reel_row = itemgetter(*REEL_CSV_FIELDS)
+
+# Internal field set by normalize_clip and removed by select_top_k.
+_SORT_KEY = "_sort_key"
+_sort_key_getter = itemgetter(_SORT_KEY)
+
+
+ERROR_LOG_PATH = Path("error_log.jsonl")
+_ERR_FH: Optional[BinaryIO] = None
+_ERR_LOCK = threading.Lock()
+
 
-@dataclass
-class AccountWithReels:
-    account: AccountDict
-    top_reels: List[MediaDict]
+def _close_error_log() -> None:
+    global _ERR_FH
+    with _ERR_LOCK:
+        if _ERR_FH is not None:
+            _ERR_FH.close()
+            _ERR_FH = None
+
+
+def _write_log_record(record: Dict[str, Any]) -> None:
+    """Append one record to error_log.jsonl (one shared buffered handle, opened lazily)."""
+    global _ERR_FH
+    try:
+        line = orjson.dumps(record, default=str, option=orjson.OPT_UTC_Z) + b"\n"
+        with _ERR_LOCK:
+            if _ERR_FH is None:
+                _ERR_FH = ERROR_LOG_PATH.open("ab", buffering=ERROR_LOG_BUFFER)
+                atexit.register(_close_error_log)
+            _ERR_FH.write(line)
+    except Exception:
+        pass
+
+
+def log_warn(context: str, **info: Any) -> None:
+    """Log an expected, non-exception condition (e.g. state=false payload); no traceback."""
+    _write_log_record({"ts": datetime.now(timezone.utc), "context": context, **info})
 
 
 def log_error(context: str, **info: Any) -> None:
-    """Append a debug record to error_log.jsonl."""
+    """Log a caught exception (`_exc`) with its type, message and formatted traceback."""
     record: Dict[str, Any] = {
-        "ts": datetime.now(timezone.utc).isoformat(),
+        "ts": datetime.now(timezone.utc),
         "context": context,
         **{k: v for k, v in info.items() if k != "_exc"},
     }
@@ -82,12 +362,7 @@ def log_error(context: str, **info: Any) -> None:
         record["error_type"] = type(exc).__name__
         record["error_message"] = str(exc)
         record["traceback"] = "".join(format_exception(type(exc), exc, exc.__traceback__))
-    try:
-        Path("error_log.jsonl").open("a", encoding="utf-8").write(
-            json.dumps(record, ensure_ascii=False) + "\n"
-        )
-    except Exception:
-        pass
+    _write_log_record(record)
 
 
 def get_token(cli_token: Optional[str]) -> str:
@@ -98,139 +373,234 @@ def get_token(cli_token: Optional[str]) -> str:
 
 
 async def search_accounts(
-    client: AsyncClient, query: str, max_accounts: int
-) -> List[AccountDict]:
-    """Search accounts by keyword using fbsearch_accounts_v3 (paginated, non-deprecated)."""
-    candidates: List[AccountDict] = []
-    page_token: Optional[str] = None
+    client: AsyncClient,
+    query: str,
+    max_accounts: int,
+    retries: int = RETRY_ATTEMPTS,
+    seen: Optional[set] = None,
+) -> AsyncIterator[AccountDict]:
+    """Search accounts by keyword using fbsearch_accounts_v3 (paginated, non-deprecated).
+
+    Async generator: users are yielded (deduped by pk) as soon as their page arrives,
+    and the next page is requested in the background before yielding, so callers can
+    start per-account work while search is still paginating.
+
+    Dedup happens per page, so only unique users count towards max_accounts and no
+    further page is requested once enough are known. Pass a shared `seen` set to
+    dedupe (and cap) across several queries.
+    """
+    async def fetch(pt: Optional[str]) -> Any:
+        # Search pages go ahead of queued account requests in the limiter.
+        _LIMITER_PRIORITY.set(True)
+        return await _with_retry(lambda: client.fbsearch_accounts_v3(query, page_token=pt), retries)
 
-    while len(candidates) < max_accounts:
-        try:
-            res = await _with_retry(
-                lambda pt=page_token: client.fbsearch_accounts_v3(query, page_token=pt)
-            )
-        except Exception as e:
-            print(f"[WARN] fbsearch_accounts_v3 failed: {e}", file=sys.stderr)
-            log_error("fbsearch_accounts_v3", query=query, _exc=e)
-            break
-
-        if not isinstance(res, dict):
-            break
-        # HikerAPI can return error payload instead of data
-        if res.get("state") is False:
-            err = res.get("error") or res.get("exc_type") or "Unknown API error"
-            print(f"[WARN] API error: {err}", file=sys.stderr)
-            break
-
-        users = res.get("users") or []
-        candidates.extend(users)
-
-        # Pagination: different API versions may use page_token or next_page_token
-        page_token = res.get("page_token") or res.get("next_page_token")
-        has_more = res.get("has_more")
-        if not has_more or not page_token or len(candidates) >= max_accounts:
-            break
-
-    # Deduplicate by pk, cap
-    seen: set = set()
-    deduped: List[AccountDict] = []
-    for u in candidates:
-        pk = str(u.get("pk") or u.get("id") or "")
-        if pk and pk not in seen:
-            seen.add(pk)
-            deduped.append(u)
-            if len(deduped) >= max_accounts:
+    def fetch_page(pt: Optional[str]) -> "asyncio.Task[Any]":
+        return asyncio.create_task(fetch(pt))
+
+    if seen is None:
+        seen = set()
+    next_page: Optional["asyncio.Task[Any]"] = fetch_page(None)
+    try:
+        while next_page is not None:
+            try:
+                res = await next_page
+            except _SKIP_EXCEPTIONS as e:
+                print(f"[WARN] fbsearch_accounts_v3 failed: {e}", file=sys.stderr)
+                log_error("fbsearch_accounts_v3", query=query, _exc=e)
+                break
+            next_page = None
+
+            if not isinstance(res, dict):
                 break
-    return deduped
+            # HikerAPI can return error payload instead of data
+            if res.get("state") is False:
+                err = res.get("error") or res.get("exc_type") or "Unknown API error"
+                print(f"[WARN] API error: {err}", file=sys.stderr)
+                log_warn("fbsearch_accounts_v3_state_false", query=query, payload=res)
+                break
+
+            deduped: List[AccountDict] = []
+            for u in res.get("users") or []:
+                pk = str(u.get("pk") or u.get("id") or "")
+                if pk and pk not in seen:
+                    seen.add(pk)
+                    deduped.append(u)
+                    if len(seen) >= max_accounts:
+                        break
+
+            # Pagination: different API versions may use page_token or next_page_token
+            page_token = res.get("page_token") or res.get("next_page_token")
+            if res.get("has_more") and page_token and len(seen) < max_accounts:
+                next_page = fetch_page(page_token)
+
+            for u in deduped:
+                yield u
+    finally:
+        # Consumer stopped early (or we hit the cap): drop the prefetched page.
+        if next_page is not None:
+            next_page.cancel()
 
 
 async def fetch_profile(
-    client: AsyncClient, raw_user: AccountDict
+    client: AsyncClient,
+    raw_user: AccountDict,
+    retries: int = RETRY_ATTEMPTS,
+    cache: Optional[ResponseCache] = None,
+    refresh: bool = False,
 ) -> Optional[AccountDict]:
     """Fetch full profile by id using user_by_id_v2 (non-deprecated).
 
     HikerAPI v2 responses are usually wrapped, e.g. {"state": true, "user": {...}}.
     This function returns the inner user dict so the rest of the code works
-    with a flat profile object.
+    with a flat profile object. Successful profiles are cached when `cache` is set;
+    `refresh` skips the cache read but still stores the fresh profile.
     """
     pk = raw_user.get("pk") or raw_user.get("id")
     if not pk:
         return None
+    if cache is not None and not refresh:
+        hit = cache.get("profile", str(pk))
+        if hit is not None:
+            return hit
     try:
-        profile = await _with_retry(lambda: client.user_by_id_v2(str(pk)))
-    except Exception as e:
+        profile = await _with_retry(lambda: client.user_by_id_v2(str(pk)), retries)
+    except _SKIP_EXCEPTIONS as e:
         print(f"[WARN] user_by_id_v2 failed for pk={pk}: {e}", file=sys.stderr)
         log_error("user_by_id_v2", pk=str(pk), username=raw_user.get("username"), _exc=e)
         return None
     if not isinstance(profile, dict):
         return None
-    if profile.get("state") is False:
-        # API-level error, e.g. InsufficientFunds or not found
-        log_error("user_by_id_v2_state_false", pk=str(pk), payload=profile)
+    if profile.get("state") is False or ("detail" in profile and "user" not in profile):
+        # API-level error, e.g. InsufficientFunds, not found (404) or forbidden (403)
+        log_warn("user_by_id_v2_state_false", pk=str(pk), payload=profile)
         return None
     # Unwrap common shapes: {"user": {...}}, {"data": {...}}, or already flat
     inner = profile.get("user") or profile.get("data") or profile
-    return inner if isinstance(inner, dict) else None
+    if not isinstance(inner, dict):
+        return None
+    if cache is not None:
+        cache.set("profile", str(pk), inner)
+    return inner
 
 
 async def fetch_reels(
-    client: AsyncClient, user_id: str, count: int
+    client: AsyncClient,
+    user_id: str,
+    count: int,
+    retries: int = RETRY_ATTEMPTS,
+    cache: Optional[ResponseCache] = None,
 ) -> List[MediaDict]:
-    """Fetch up to count reels using user_clips helper (handles pagination)."""
+    """Fetch up to count reels using user_clips helper (handles pagination).
+
+    user_clips issues one request per page internally; with HikerClient each page
+    takes its own limiter slot. Results are cached per (user_id, count) when `cache` is set.
+    """
+    cache_key = f"{user_id}:{count}"
+    if cache is not None:
+        hit = cache.get("reels", cache_key)
+        if hit is not None:
+            return hit
     try:
         clips = await _with_retry(
-            lambda: client.user_clips(user_id=str(user_id), count=count)
+            lambda: client.user_clips(user_id=str(user_id), count=count),
+            retries,
         )
-    except Exception as e:
+    except _CLIPS_SKIP_EXCEPTIONS as e:
         print(f"[WARN] user_clips failed for user_id={user_id}: {e}", file=sys.stderr)
         log_error("user_clips", user_id=str(user_id), requested_count=count, _exc=e)
         return []
-    return clips[:count] if isinstance(clips, list) else []
+    if not isinstance(clips, list):
+        return []
+    clips = clips[:count]
+    if cache is not None:
+        cache.set("reels", cache_key, clips)
+    return clips
+
+
+# Profile fields only user_by_id_v2 reliably returns; if a search hit already has
+# them, the extra round-trip adds nothing. external_url may legitimately be null.
+_PROFILE_ONLY_FIELDS = ("biography", "follower_count", "following_count", "media_count")
+
+
+def _search_payload_is_complete(raw: AccountDict) -> bool:
+    """True if a fbsearch_accounts_v3 user already carries every exported profile field."""
+    return "external_url" in raw and all(raw.get(k) is not None for k in _PROFILE_ONLY_FIELDS)
 
 
 def normalize_profile(raw: AccountDict, profile: Optional[AccountDict]) -> AccountDict:
     """Normalize to stable schema; surname = last token of full_name."""
     src = profile or raw
-    pk = str(src.get("pk") or raw.get("pk") or src.get("id") or "")
-    full_name = src.get("full_name") or raw.get("full_name")
-    parts = full_name.strip().split() if isinstance(full_name, str) else []
+    _get = src.get
+    raw_get = raw.get
+    pk = _get("pk") or raw_get("pk") or _get("id") or ""
+    full_name = _get("full_name") or raw_get("full_name")
+    parts = full_name.strip().split() if type(full_name) is str else []
     return {
-        "id": pk,
-        "username": src.get("username") or raw.get("username"),
+        "id": pk if type(pk) is str else str(pk),
+        "username": _get("username") or raw_get("username"),
         "full_name": full_name,
         "surname": parts[-1] if len(parts) >= 2 else None,
-        "biography": src.get("biography"),
-        "external_url": src.get("external_url"),
-        "follower_count": src.get("follower_count"),
-        "following_count": src.get("following_count"),
-        "media_count": src.get("media_count"),
-        "is_verified": src.get("is_verified"),
-        "is_private": src.get("is_private"),
+        "biography": _get("biography"),
+        "external_url": _get("external_url"),
+        "follower_count": _get("follower_count"),
+        "following_count": _get("following_count"),
+        "media_count": _get("media_count"),
+        "is_verified": _get("is_verified"),
+        "is_private": _get("is_private"),
     }
 
 
+# HikerAPI v2 clip keys, in the order normalize_clip unpacks them.
+_FAST_KEYS = ("pk", "code", "taken_at", "play_count", "like_count", "comment_count", "caption_text")
+
+
+def _clip_sort_key(views: Any, taken_at: Any) -> Tuple[int, int]:
+    """Ranking key for select_top_k: (-views, -taken_at), bad values count as 0."""
+    try:
+        t = int(taken_at or 0)
+    except (TypeError, ValueError):
+        t = 0
+    return (-(int(views) if isinstance(views, (int, float)) else 0), -t)
+
+
 def normalize_clip(
     raw: MediaDict, account_id: str, account_username: Optional[str]
 ) -> MediaDict:
-    """Normalize reel to stable schema."""
-    media_id = str(raw.get("pk") or raw.get("id") or "")
-    code = raw.get("code") or raw.get("shortcode")
-    taken_at = raw.get("taken_at") or raw.get("taken_at_timestamp") or raw.get("timestamp")
-    if isinstance(taken_at, dict):
+    """Normalize reel to stable schema.
+
+    Fast path: one C-level map over the HikerAPI v2 keys (_FAST_KEYS); the fallback
+    keys and edge_*/caption dict shapes are only looked at when a value is missing.
+    """
+    _get = raw.get
+    pk, code, taken_at, views, like_count, comment_count, caption_text = map(_get, _FAST_KEYS)
+    if not pk:
+        pk = _get("id") or ""
+    media_id = pk if type(pk) is str else str(pk)
+    if not code:
+        code = _get("shortcode")
+    if not taken_at:
+        taken_at = _get("taken_at_timestamp") or _get("timestamp")
+    if type(taken_at) is dict:
         taken_at = taken_at.get("timestamp")
-    views = raw.get("play_count") or raw.get("view_count") or raw.get("video_view_count")
-    like_count = raw.get("like_count")
-    if like_count is None and isinstance(raw.get("edge_liked_by"), dict):
-        like_count = raw["edge_liked_by"].get("count")
-    comment_count = raw.get("comment_count")
-    if comment_count is None and isinstance(raw.get("edge_media_to_comment"), dict):
-        comment_count = raw["edge_media_to_comment"].get("count")
-    caption_text = raw.get("caption_text")
-    if caption_text is None and "caption" in raw:
-        cap = raw["caption"]
-        caption_text = cap.get("text") or cap.get("caption_text") if isinstance(cap, dict) else (cap if isinstance(cap, str) else None)
+    if not views:
+        views = _get("view_count") or _get("video_view_count")
+    if like_count is None:
+        edge = _get("edge_liked_by")
+        if type(edge) is dict:
+            like_count = edge.get("count")
+    if comment_count is None:
+        edge = _get("edge_media_to_comment")
+        if type(edge) is dict:
+            comment_count = edge.get("count")
+    if caption_text is None:
+        cap = _get("caption")
+        if type(cap) is dict:
+            caption_text = cap.get("text") or cap.get("caption_text")
+        elif type(cap) is str:
+            caption_text = cap
     permalink = f"https://www.instagram.com/reel/{code}/" if code and account_username else None
     return {
+        _SORT_KEY: _clip_sort_key(views, taken_at),
         "media_id": media_id,
         "code": code,
         "taken_at": taken_at,
@@ -245,16 +615,65 @@ def normalize_clip(
 
 
 def select_top_k(reels: Iterable[MediaDict], k: int) -> List[MediaDict]:
-    """Sort by views desc, then taken_at desc; return first k."""
-    def key(r: MediaDict) -> Tuple[int, int]:
-        v = r.get("views")
-        t = r.get("taken_at") or 0
-        try:
-            t = int(t)
-        except (TypeError, ValueError):
-            t = 0
-        return (-(int(v) if isinstance(v, (int, float)) else 0), -t)
-    return sorted(reels, key=key)[:k]
+    """Views desc, then taken_at desc; return first k (O(n log k) via heapq).
+
+    Reels must come from normalize_clip; the precomputed sort key is stripped from
+    the returned rows so it never reaches the exports.
+    """
+    top = heapq.nsmallest(k, reels, key=_sort_key_getter)
+    for r in top:
+        del r[_SORT_KEY]
+    return top
+
+
+class OutputWriter:
+    """Streams accounts to <base>_accounts.jsonl, _accounts.csv and _reels.csv.
+
+    Files are opened (and truncated) on the first write, so a run that finds nothing
+    leaves outputs from a previous run at the same prefix untouched.
+    """
+
+    def __init__(self, out_base: str) -> None:
+        self._out_base = out_base
+        self._files: List[IO[Any]] = []
+        self.written = 0
+
+    def _open(self) -> None:
+        base = self._out_base
+        self._jsonl_f = Path(base + "_accounts.jsonl").open("wb", buffering=WRITE_BUFFER)
+        self._files.append(self._jsonl_f)
+        acc_f = Path(base + "_accounts.csv").open("w", encoding="utf-8", newline="", buffering=WRITE_BUFFER)
+        self._files.append(acc_f)
+        reel_f = Path(base + "_reels.csv").open("w", encoding="utf-8", newline="", buffering=WRITE_BUFFER)
+        self._files.append(reel_f)
+        # Plain csv.writer over itemgetter rows: no per-row DictWriter field lookups.
+        self._acc_writer = csv.writer(acc_f)
+        self._acc_writer.writerow(ACCOUNT_CSV_FIELDS)
+        self._reel_writer = csv.writer(reel_f)
+        self._reel_writer.writerow(REEL_CSV_FIELDS)
+
+    def write(self, account: AccountDict, top_reels: List[MediaDict]) -> None:
+        if not self._files:
+            self._open()
+        self._jsonl_f.write(orjson.dumps({"account": account, "top_reels": top_reels}) + b"\n")
+        self._acc_writer.writerow(_account_row(account))
+        self._reel_writer.writerows(map(_reel_row, top_reels))
+        self.written += 1
+        if self.written % FLUSH_EVERY == 0:
+            for f in self._files:
+                f.flush()
+
+    def close(self) -> None:
+        for f in self._files:
+            f.close()
+        self._files = []
+
+
+def _normalize_clips_batch(
+    clips: List[MediaDict], account_id: str, account_username: Optional[str], k: int
+) -> List[MediaDict]:
+    """normalize_clip over one account's reels + select_top_k (top-level so it pickles for the process pool)."""
+    return select_top_k((normalize_clip(c, account_id, account_username) for c in clips), k)
 
 
 async def process_accounts(
@@ -263,92 +682,156 @@ async def process_accounts(
     max_accounts: int,
     recent_reels: int,
     top_k: int,
-    concurrency: int = DEFAULT_CONCURRENCY,
-) -> List[AccountWithReels]:
-    """Search (one or many queries) -> fetch profile + reels -> normalize -> top-k."""
+    out_base: str,
+    retries: int = RETRY_ATTEMPTS,
+    pool: Optional[Executor] = None,
+    cache: Optional[ResponseCache] = None,
+    always_refresh_profile: bool = False,
+) -> int:
+    """Search (one or many queries) -> fetch profile + reels -> normalize -> top-k -> write.
+
+    Each account is written to the JSONL and CSV outputs as soon as its task completes,
+    so memory stays O(in-flight accounts) instead of O(max_accounts). Returns the
+    number of accounts written. Reel batches of NORMALIZE_OFFLOAD_MIN or more are
+    normalized in `pool` (if given) to keep the event loop responsive. Search hits that
+    already carry the full profile skip user_by_id_v2 unless always_refresh_profile.
+    Request rate/concurrency limits are enforced by the client (see HikerClient).
+    """
     print(f"[INFO] Searching accounts for queries: {queries}", file=sys.stderr)
 
-    all_candidates: List[AccountDict] = []
-    for q in queries:
-        found = await search_accounts(client, q, max_accounts)
-        # Optionally tag which query matched (not exported, but useful in debugging)
-        for u in found:
-            u.setdefault("_search_queries", set()).add(q)
-        all_candidates.extend(found)
-
-    # Deduplicate across all queries by pk and respect global max_accounts
+    # Concurrency is bounded per HTTP request by HikerClient's limiter, not per account
+    # task, so the overlapping profile + reels requests below each take their own slot.
+    async def one(raw: AccountDict) -> Optional[AccountWithReels]:
+        pk = str(raw.get("pk") or raw.get("id"))
+        username = raw.get("username")
+        print(f"[INFO] Processing {username} (pk={pk})", file=sys.stderr)
+        # user_clips only needs the pk from search, so start it alongside the profile fetch.
+        clips_task = asyncio.create_task(fetch_reels(client, pk, recent_reels, retries, cache))
+        if not always_refresh_profile and _search_payload_is_complete(raw):
+            profile: Optional[AccountDict] = raw
+        else:
+            try:
+                profile = await fetch_profile(client, raw, retries, cache, always_refresh_profile)
+            except BaseException:
+                clips_task.cancel()
+                raise
+        if not profile:
+            clips_task.cancel()
+            print(f"[WARN] Skipping {username}: no profile", file=sys.stderr)
+            return None
+        norm = normalize_profile(raw, profile)
+        clips = await clips_task
+        if pool is not None and len(clips) >= NORMALIZE_OFFLOAD_MIN:
+            top = await asyncio.get_running_loop().run_in_executor(
+                pool, _normalize_clips_batch, clips, norm["id"], norm["username"], top_k
+            )
+        else:
+            top = _normalize_clips_batch(clips, norm["id"], norm["username"], top_k)
+        return norm, top
+
+    # account task -> its search payload, so task-level failures can be attributed
+    pending: Dict["asyncio.Task[Any]", AccountDict] = {}
+    # Every finished task (accounts and the search task) lands here via a done callback,
+    # so the writer wakes for tasks spawned after it started waiting.
+    finished: "asyncio.Queue[asyncio.Task[Any]]" = asyncio.Queue()
+    # Shared across queries: search dedupes by pk and stops at the global max_accounts
     seen: set = set()
-    candidates: List[AccountDict] = []
-    for u in all_candidates:
-        pk = str(u.get("pk") or u.get("id") or "")
-        if pk and pk not in seen:
-            seen.add(pk)
-            candidates.append(u)
-            if len(candidates) >= max_accounts:
-                break
-
-    print(f"[INFO] Found {len(candidates)} unique candidate accounts", file=sys.stderr)
-
-    results: List[AccountWithReels] = []
-    sem = asyncio.Semaphore(concurrency)
-
-    async def one(raw: AccountDict) -> None:
-        async with sem:
-            pk = raw.get("pk") or raw.get("id")
-            username = raw.get("username")
-            print(f"[INFO] Processing {username} (pk={pk})", file=sys.stderr)
-            profile = await fetch_profile(client, raw)
-            if not profile:
-                print(f"[WARN] Skipping {username}: no profile", file=sys.stderr)
-                return
-            norm = normalize_profile(raw, profile)
-            clips = await fetch_reels(client, norm["id"], recent_reels)
-            norm_clips = [normalize_clip(c, norm["id"], norm["username"]) for c in clips]
-            top = select_top_k(norm_clips, top_k)
-            results.append(AccountWithReels(account=norm, top_reels=top))
 
-    # Full result set kept in memory until main_async writes; fine for typical max_accounts.
-    await asyncio.gather(*[asyncio.create_task(one(u)) for u in candidates])
-    results.sort(key=lambda a: (a.account.get("follower_count") or 0), reverse=True)
-    return results
-
-
-def main_async(args: argparse.Namespace) -> None:
-    client = AsyncClient(token=get_token(args.token), timeout=args.timeout)
-    queries = args.query if isinstance(args.query, list) else [args.query]
-    data = asyncio.run(
-        process_accounts(
+    async def spawn() -> None:
+        """Consume search pages and start per-account tasks as users arrive."""
+        for q in queries:
+            if len(seen) >= max_accounts:
+                break
+            # A failure here ends only this query; the remaining queries are still searched.
+            try:
+                async with aclosing(search_accounts(client, q, max_accounts, retries, seen)) as found:
+                    async for u in found:
+                        # Tag which query found it first (not exported, but useful in debugging)
+                        u["_search_query"] = q
+                        task = asyncio.create_task(one(u))
+                        task.add_done_callback(finished.put_nowait)
+                        pending[task] = u
+            except Exception as e:
+                print(f"[WARN] Search for {q!r} failed: {type(e).__name__}: {e}", file=sys.stderr)
+                log_error("search", query=q, _exc=e)
+        print(f"[INFO] Found {len(seen)} unique candidate accounts", file=sys.stderr)
+
+    out = OutputWriter(out_base)
+    try:
+        # Rows are written in completion order (not sorted by follower_count).
+        # The search task keeps adding to `pending` while we drain finished accounts.
+        search_task = asyncio.create_task(spawn())
+        search_task.add_done_callback(finished.put_nowait)
+        searching = True
+        while searching or pending:
+            fut = await finished.get()
+            raw: AccountDict = {}
+            if fut is search_task:
+                searching = False
+            else:
+                raw = pending.pop(fut)
+            # Unexpected (non-API) errors end only their own task; log and keep going.
+            exc = fut.exception()
+            if exc is not None:
+                pk = str(raw.get("pk") or raw.get("id") or "") or None
+                username = raw.get("username")
+                print(f"[WARN] Task failed for {username} (pk={pk}): {type(exc).__name__}: {exc}", file=sys.stderr)
+                log_error("task", pk=pk, username=username, _exc=exc)
+                continue
+            item = fut.result()
+            if item is not None:
+                out.write(*item)
+    finally:
+        out.close()
+    return out.written
+
+
+async def _run(
+    args: argparse.Namespace,
+    token: str,
+    queries: List[str],
+    base_str: str,
+    pool: Executor,
+    cache: Optional[ResponseCache],
+) -> int:
+    """Build the HTTP client inside the running loop and close its pool when done."""
+    async with HikerClient(token, args.timeout, args.connections, args.rate) as client:
+        return await process_accounts(
             client,
             queries,
             args.max_accounts,
             args.recent_reels,
             args.top_k,
-            concurrency=args.concurrency,
+            base_str,
+            retries=args.retries,
+            pool=pool,
+            cache=cache,
+            always_refresh_profile=args.always_refresh_profile,
         )
-    )
-    if not data:
-        print("[INFO] No accounts with reels found.", file=sys.stderr)
-        return
+
+
+def main_async(args: argparse.Namespace) -> None:
+    token = get_token(args.token)
+    queries = args.query if isinstance(args.query, list) else [args.query]
     out_dir = Path(args.output_prefix)
     out_dir.parent.mkdir(parents=True, exist_ok=True)
     base = out_dir.with_suffix("") if out_dir.suffix else out_dir
     base_str = str(base)
-
-    with Path(base_str + "_accounts.jsonl").open("w", encoding="utf-8") as f:
-        for item in data:
-            f.write(json.dumps({"account": item.account, "top_reels": item.top_reels}, ensure_ascii=False) + "\n")
-    with Path(base_str + "_accounts.csv").open("w", encoding="utf-8", newline="") as f:
-        w = csv.DictWriter(f, fieldnames=ACCOUNT_CSV_FIELDS)
-        w.writeheader()
-        for item in data:
-            w.writerow(item.account)
-    with Path(base_str + "_reels.csv").open("w", encoding="utf-8", newline="") as f:
-        w = csv.DictWriter(f, fieldnames=REEL_CSV_FIELDS)
-        w.writeheader()
-        for item in data:
-            for r in item.top_reels:
-                w.writerow(r)
-    print(f"[INFO] Wrote {base_str}_accounts.jsonl, _accounts.csv, _reels.csv", file=sys.stderr)
+    cache = None if args.no_cache or args.cache_ttl <= 0 else ResponseCache(CACHE_PATH, args.cache_ttl)
+    try:
+        # Workers are spawned on first submit, so small runs never start a process.
+        # forkserver: forking this process after the event loop and httpx threads
+        # exist can copy held locks into the child and deadlock it.
+        mp_context = multiprocessing.get_context("forkserver")
+        with ProcessPoolExecutor(max_workers=args.workers or None, mp_context=mp_context) as pool:
+            written = asyncio.run(_run(args, token, queries, base_str, pool, cache))
+    finally:
+        if cache is not None:
+            cache.close()
+    if not written:
+        print("[INFO] No accounts with reels found.", file=sys.stderr)
+        return
+    print(f"[INFO] Wrote {written} accounts to {base_str}_accounts.jsonl, _accounts.csv, _reels.csv", file=sys.stderr)
 
 
 def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
@@ -371,10 +854,49 @@ def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
         help=f"Request timeout in seconds (default: {DEFAULT_REQUEST_TIMEOUT}).",
     )
     p.add_argument(
+        "--connections",
         "--concurrency",
+        dest="connections",
         type=int,
         default=DEFAULT_CONCURRENCY,
-        help=f"Max concurrent account tasks (default: {DEFAULT_CONCURRENCY}).",
+        help=f"Max in-flight HikerAPI requests (default: {DEFAULT_CONCURRENCY}).",
+    )
+    p.add_argument(
+        "--rate",
+        type=float,
+        default=DEFAULT_RATE,
+        help=f"Max HikerAPI requests per second; 0 disables (default: {DEFAULT_RATE:g}).",
+    )
+    p.add_argument(
+        "--cache-ttl",
+        type=float,
+        default=DEFAULT_CACHE_TTL,
+        help=f"Seconds to reuse cached profile/reels responses from {CACHE_PATH} (default: {DEFAULT_CACHE_TTL:g}).",
+    )
+    p.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always hit HikerAPI for profiles/reels; do not read or write the response cache.",
+    )
+    p.add_argument(
+        "--always-refresh-profile",
+        action="store_true",
+        help="Call user_by_id_v2 for every account, bypassing search-result profiles and cached profiles.",
+    )
+    p.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help=(
+            f"Processes for normalizing reel batches of {NORMALIZE_OFFLOAD_MIN}+ items "
+            "(default: 0 = CPU count)."
+        ),
+    )
+    p.add_argument(
+        "--retries",
+        type=int,
+        default=RETRY_ATTEMPTS,
+        help=f"Attempts per API call on timeouts/429/5xx (default: {RETRY_ATTEMPTS}).",
     )
     return p.parse_args(argv)
 